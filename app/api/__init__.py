@@ -1,6 +1,8 @@
 from fastapi import APIRouter
-from . import users, documents
+from . import users, documents, generated_docs, profiles
 
 api_router = APIRouter()
 api_router.include_router(users.router)
 api_router.include_router(documents.router)
+api_router.include_router(generated_docs.router)
+api_router.include_router(profiles.router)
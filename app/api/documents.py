@@ -1,46 +1,71 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from .. import repository
+from fastapi import APIRouter, Depends, Request, status, HTTPException
+from .. import repository, task_queue, tracing
 from ..schemas import (
     AsyncDocumentRequest,
     TaskAccepted,
 )
 from ..security import get_api_key
+from ..profiling import RouteClass
+from ..redis_client import redis_client
 import uuid
 import json
+import time
 import redis
-import os
-
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST", "localhost"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    decode_responses=True,
-)
 
 router = APIRouter(
     prefix="/documents",
     tags=["Documents"],
     dependencies=[Depends(get_api_key)],
+    route_class=RouteClass,
 )
 
 
 @router.post(
     "/generate/async", status_code=status.HTTP_202_ACCEPTED, response_model=TaskAccepted
 )
-def generate_document_async(req: AsyncDocumentRequest):
-    user = repository.get_user_by_id(req.user_id)
+def generate_document_async(
+    req: AsyncDocumentRequest, request: Request, api_key: str = Depends(get_api_key)
+):
     request_id = uuid.uuid4()
+    with tracing.span(request_id, "api.accept"):
+        return _accept_document_request(request_id, req, request, api_key)
+
+
+def _accept_document_request(
+    request_id: uuid.UUID, req: AsyncDocumentRequest, request: Request, api_key: str
+):
+    tenant = task_queue.tenant_for(redis_client, api_key, req.client_id)
+    with tracing.span(request_id, "api.user_lookup"):
+        user = repository.get_user_by_id(req.user_id)
 
     redis_key = f"{request_id}_{req.content_type}"
-    redis_value = {"user_data": user.model_dump(), "callback_url": req.callback_url}
+    redis_value = {
+        "user_data": user.model_dump(),
+        "callback_url": req.callback_url,
+        "priority": req.priority,
+        "tenant": tenant,
+        "enqueued_at": time.time(),
+    }
+    if getattr(request.state, "profile_id", None):
+        redis_value["profile_id"] = request.state.profile_id
 
     try:
-        redis_client.set(redis_key, json.dumps(redis_value))
-        repository.log_generation_request(
-            request_id=request_id,
-            user_id=user.id,
-            doc_type=req.content_type,
-            request_body=json.dumps(redis_value),
-        )
+        with tracing.span(request_id, "api.redis_enqueue"):
+            task_queue.enqueue_task(
+                redis_client,
+                redis_key,
+                json.dumps(redis_value),
+                doc_type=req.content_type,
+                priority=req.priority,
+                tenant=tenant,
+            )
+        with tracing.span(request_id, "api.log_write"):
+            repository.log_generation_request(
+                request_id=request_id,
+                user_id=user.id,
+                doc_type=req.content_type,
+                request_body=json.dumps(redis_value),
+            )
     except redis.exceptions.ConnectionError as e:
         raise HTTPException(status_code=503, detail=f"Сервер Redis недоступен: {e}")
     except Exception as e:
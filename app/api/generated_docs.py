@@ -0,0 +1,42 @@
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from fastapi.responses import FileResponse
+from .. import storage
+from ..security import get_api_key
+from ..profiling import RouteClass
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+router = APIRouter(
+    prefix="/generated_docs",
+    tags=["Generated documents"],
+    dependencies=[Depends(get_api_key)],
+    route_class=RouteClass,
+)
+
+
+@router.get("/{name}", response_class=FileResponse)
+def download_document(name: str, if_none_match: str | None = Header(default=None)):
+    path = storage.document_path(name)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Документ не найден")
+
+    # Имя файла - хеш содержимого, поэтому он подходит как сильный ETag,
+    # а сам файл никогда не меняется.
+    etag = f'"{name.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(
+        path,
+        media_type=MEDIA_TYPES[name.rsplit(".", 1)[1]],
+        filename=name,
+        headers=headers,
+    )
@@ -0,0 +1,20 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from .. import profiling
+from ..security import get_api_key
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["Profiling"],
+    dependencies=[Depends(get_api_key)],
+    route_class=profiling.RouteClass,
+)
+
+
+@router.get("/{profile_id}", response_class=FileResponse)
+def download_profile(profile_id: str):
+    path = profiling.profile_path(profile_id)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
@@ -3,11 +3,13 @@ from fastapi import APIRouter, Depends, status, Query
 from .. import repository
 from ..schemas import User, UserCreate, UserUpdate
 from ..security import get_api_key
+from ..profiling import RouteClass
 
 router = APIRouter(
     prefix="/users",
     tags=["Users"],
     dependencies=[Depends(get_api_key)],
+    route_class=RouteClass,
 )
 
 
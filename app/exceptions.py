@@ -8,3 +8,9 @@ class UserAlreadyExistsError(Exception):
     def __init__(self, detail: str):
         self.detail = detail
         super().__init__(detail)
+
+
+class TooManyClientsError(Exception):
+    def __init__(self, limit: int):
+        self.limit = limit
+        super().__init__(f"Превышено число client_id для API-ключа: {limit}")
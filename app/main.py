@@ -1,10 +1,13 @@
+import asyncio
 import logging
+import redis
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from .api import api_router
-from .exceptions import UserNotFoundError, UserAlreadyExistsError
-from . import repository
+from .exceptions import TooManyClientsError, UserNotFoundError, UserAlreadyExistsError
+from . import repository, tracing
+from .profiling import PROFILING_ENABLED, ProfilingMiddleware
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,16 +18,22 @@ async def lifespan(app: FastAPI):
     logger.info("Приложение запускается")
 
     try:
-        repository.create_table_if_not_exists()
-        logger.info("Таблицы 'users' и 'generation_logs' в ClickHouse готова")
+        repository.run_migrations()
+        logger.info("Схема ClickHouse в актуальной версии")
     except Exception as e:
-        logger.error(f"Не удалось подключиться или создать таблицу в ClickHouse: {e}")
+        logger.error(f"Не удалось подключиться или применить миграции ClickHouse: {e}")
+    span_flusher = asyncio.create_task(tracing.flush_periodically())
     yield
     logger.info("Приложение останавливается")
+    span_flusher.cancel()
+    tracing.flush()
 
 
 app = FastAPI(lifespan=lifespan)
 
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 
 @app.exception_handler(UserNotFoundError)
 async def user_not_found_handler(request: Request, exc: UserNotFoundError):
@@ -39,6 +48,20 @@ async def user_already_exists_handler(request: Request, exc: UserAlreadyExistsEr
     return JSONResponse(status_code=400, content={"message": exc.detail})
 
 
+@app.exception_handler(TooManyClientsError)
+async def too_many_clients_handler(request: Request, exc: TooManyClientsError):
+    return JSONResponse(status_code=429, content={"message": str(exc)})
+
+
+@app.exception_handler(redis.exceptions.ConnectionError)
+async def redis_unavailable_handler(
+    request: Request, exc: redis.exceptions.ConnectionError
+):
+    return JSONResponse(
+        status_code=503, content={"message": f"Сервер Redis недоступен: {exc}"}
+    )
+
+
 app.include_router(api_router)
 
 
@@ -0,0 +1,139 @@
+import logging
+from datetime import datetime
+from typing import List, NamedTuple
+from clickhouse_connect.driver.client import Client
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: List[str]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version=1,
+        name="initial_schema",
+        statements=[
+            """
+            CREATE TABLE IF NOT EXISTS users(
+                id String,
+                last_name String,
+                first_name String,
+                middle_name Nullable(String),
+                phone_number String,
+                iin String,
+                photo_url Nullable(String)
+            ) ENGINE = MergeTree()
+            ORDER BY id
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS generation_logs(
+                request_id String,
+                user_id String,
+                doc_type String,
+                status String,
+                request_time DateTime,
+                duration_ms Nullable(Int32),
+                request_body String,
+                result_url Nullable(String)
+            ) ENGINE = MergeTree()
+            ORDER BY request_time
+            """,
+        ],
+    ),
+    # Таблица пересоздается целиком: ключ партиционирования и ORDER BY
+    # нельзя изменить через ALTER у существующей MergeTree-таблицы.
+    Migration(
+        version=2,
+        name="generation_logs_partitioned",
+        statements=[
+            "DROP TABLE IF EXISTS generation_logs_v2",
+            """
+            CREATE TABLE generation_logs_v2(
+                request_id String CODEC(ZSTD(1)),
+                user_id String CODEC(ZSTD(1)),
+                doc_type LowCardinality(String),
+                status LowCardinality(String),
+                request_time DateTime CODEC(DoubleDelta, ZSTD(1)),
+                duration_ms Nullable(Int32) CODEC(ZSTD(1)),
+                request_body String CODEC(ZSTD(3)),
+                result_url Nullable(String) CODEC(ZSTD(1)),
+                INDEX idx_request_id request_id TYPE bloom_filter(0.001) GRANULARITY 1,
+                INDEX idx_user_id user_id TYPE bloom_filter(0.01) GRANULARITY 1
+            ) ENGINE = MergeTree()
+            PARTITION BY toYYYYMM(request_time)
+            ORDER BY (request_time, request_id)
+            TTL request_time + INTERVAL 180 DAY DELETE
+            """,
+            "INSERT INTO generation_logs_v2 SELECT * FROM generation_logs",
+            """
+            RENAME TABLE
+                generation_logs TO generation_logs_legacy,
+                generation_logs_v2 TO generation_logs
+            """,
+            "DROP TABLE IF EXISTS generation_logs_legacy",
+        ],
+    ),
+    Migration(
+        version=3,
+        name="generation_spans",
+        statements=[
+            """
+            CREATE TABLE IF NOT EXISTS generation_spans(
+                request_id String CODEC(ZSTD(1)),
+                stage LowCardinality(String),
+                service LowCardinality(String),
+                start_time DateTime64(6) CODEC(DoubleDelta, ZSTD(1)),
+                duration_us UInt64 CODEC(T64, ZSTD(1)),
+                status LowCardinality(String),
+                INDEX idx_request_id request_id TYPE bloom_filter(0.001) GRANULARITY 1
+            ) ENGINE = MergeTree()
+            PARTITION BY toYYYYMM(start_time)
+            ORDER BY (stage, start_time)
+            TTL toDateTime(start_time) + INTERVAL 30 DAY DELETE
+            """,
+        ],
+    ),
+]
+
+
+def _ensure_migrations_table(client: Client):
+    client.command(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE}(
+            version UInt32,
+            name String,
+            applied_at DateTime
+        ) ENGINE = MergeTree()
+        ORDER BY version
+    """
+    )
+
+
+def get_applied_versions(client: Client) -> List[int]:
+    _ensure_migrations_table(client)
+    result = client.query(f"SELECT version FROM {MIGRATIONS_TABLE} ORDER BY version")
+    return [row[0] for row in result.result_rows]
+
+
+def apply_migrations(client: Client) -> List[int]:
+    applied = set(get_applied_versions(client))
+    newly_applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in applied:
+            continue
+        logger.info(f"Применяю миграцию {migration.version}: {migration.name}")
+        for statement in migration.statements:
+            client.command(statement)
+        client.insert(
+            MIGRATIONS_TABLE,
+            [[migration.version, migration.name, datetime.now()]],
+            column_names=["version", "name", "applied_at"],
+        )
+        newly_applied.append(migration.version)
+    return newly_applied
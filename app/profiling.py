@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import uuid
+import random
+import logging
+import asyncio
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from .security import API_KEY, API_KEY_NAME
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+PROFILES_MAX_FILES = int(os.getenv("PROFILES_MAX_FILES", "1000"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    # Снимает стеки только потоков, зарегистрированных через
+    # track_current_thread: потока пула, в котором выполняется синхронный
+    # эндпоинт, или потока event loop, пока выполняется асинхронный.
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.thread_ids = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @contextmanager
+    def track_current_thread(self):
+        thread_id = threading.get_ident()
+        self.thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            self.thread_ids.discard(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+_active_sampler: ContextVar[StackSampler | None] = ContextVar(
+    "active_sampler", default=None
+)
+
+
+def _track_endpoint_thread(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        sampler = _active_sampler.get()
+        if sampler is None:
+            return endpoint(*args, **kwargs)
+        with sampler.track_current_thread():
+            return endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+def _track_async_endpoint_thread(endpoint):
+    # Поток event loop общий для всех запросов, поэтому в профиль
+    # асинхронного эндпоинта попадают и стеки других корутин, которые
+    # выполнялись в это время.
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        sampler = _active_sampler.get()
+        if sampler is None:
+            return await endpoint(*args, **kwargs)
+        with sampler.track_current_thread():
+            return await endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = _track_async_endpoint_thread(endpoint)
+        else:
+            endpoint = _track_endpoint_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+# Без профилирования роутеры используют обычный APIRoute, и эндпоинты
+# ничем не оборачиваются.
+RouteClass = ProfiledRoute if PROFILING_ENABLED else APIRoute
+
+
+def profile_path(profile_id: str) -> str | None:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(PROFILES_DIR, f"{profile_id}.folded")
+
+
+def _profile_mtime(name: str) -> float:
+    try:
+        return os.path.getmtime(os.path.join(PROFILES_DIR, name))
+    except FileNotFoundError:
+        return 0
+
+
+def _prune_profiles():
+    names = [n for n in os.listdir(PROFILES_DIR) if n.endswith(".folded")]
+    names.sort(key=_profile_mtime, reverse=True)
+    for name in names[PROFILES_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILES_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def save_profile(profile_id: str, folded: str):
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    with open(profile_path(profile_id), "w") as f:
+        f.write(folded)
+    _prune_profiles()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    def _should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER.lower().encode()) == b"1":
+            api_key = headers.get(API_KEY_NAME.lower().encode())
+            return bool(API_KEY) and api_key == API_KEY.encode()
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["profile_id"] = profile_id
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (PROFILE_ID_HEADER.lower().encode(), profile_id.encode()),
+                ]
+            await send(message)
+
+        sampler = StackSampler()
+        token = _active_sampler.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop()
+            _active_sampler.reset(token)
+            await run_in_threadpool(save_profile, profile_id, sampler.folded())
+            logger.info(f"Профиль {profile_id} для {scope['path']} сохранен")
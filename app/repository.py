@@ -6,6 +6,7 @@ import clickhouse_connect
 from clickhouse_connect.driver.client import Client
 from .schemas import User, UserCreate, UserUpdate
 from .exceptions import UserNotFoundError, UserAlreadyExistsError
+from . import migrations, uniqueness
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -26,37 +27,11 @@ def get_clickhouse_client() -> Client:
         raise
 
 
-def create_table_if_not_exists():
+def run_migrations():
     client = get_clickhouse_client()
-    client.command(
-        """
-        CREATE TABLE IF NOT EXISTS users(
-            id String,
-            last_name String,
-            first_name String,
-            middle_name Nullable(String),
-            phone_number String,
-            iin String,
-            photo_url Nullable(String)
-        ) ENGINE = MergeTree()
-        ORDER BY id
-    """
-    )
-    client.command(
-        """
-        CREATE TABLE IF NOT EXISTS generation_logs(
-            request_id String,
-            user_id String,
-            doc_type String,
-            status String,
-            request_time DateTime,
-            duration_ms Nullable(Int32),
-            request_body String,
-            result_url Nullable(String)
-        )ENGINE = MergeTree()
-        ORDER BY request_time
-    """
-    )
+    applied = migrations.apply_migrations(client)
+    if applied:
+        logger.info(f"Применены миграции ClickHouse: {applied}")
 
 
 def get_user_by_id(user_id: str) -> User:
@@ -74,14 +49,6 @@ def get_user_by_id(user_id: str) -> User:
 
 def create_user(user_create: UserCreate) -> User:
     client = get_clickhouse_client()
-    check_q = client.query(
-        "SELECT 1 FROM users where iin = %(iin)s OR phone_number = %(phone)s LIMIT 1",
-        parameters={"iin": user_create.iin, "phone": user_create.phone_number},
-    )
-    if check_q.result_rows:
-        raise UserAlreadyExistsError(
-            detail="Пользователь с таким ИИН или телефоном уже существует"
-        )
     all_users = client.query("SELECT id from users")
     if not all_users.result_rows:
         new_id = 1
@@ -89,6 +56,12 @@ def create_user(user_create: UserCreate) -> User:
         max_id = max(int(row[0]) for row in all_users.result_rows)
         new_id = max_id + 1
     new_id_str = str(new_id)
+    if not uniqueness.reserve(
+        new_id_str, iin=user_create.iin, phone_number=user_create.phone_number
+    ):
+        raise UserAlreadyExistsError(
+            detail="Пользователь с таким ИИН или телефоном уже существует"
+        )
     new_user = User(id=new_id_str, **user_create.model_dump())
     user_tuple = (
         new_user.id,
@@ -99,7 +72,13 @@ def create_user(user_create: UserCreate) -> User:
         new_user.iin,
         new_user.photo_url,
     )
-    client.insert("users", [user_tuple])
+    try:
+        client.insert("users", [user_tuple])
+    except Exception:
+        uniqueness.release(
+            new_id_str, iin=new_user.iin, phone_number=new_user.phone_number
+        )
+        raise
     return new_user
 
 
@@ -139,21 +118,18 @@ def update_user(user_id: str, user_update: UserUpdate) -> User:
     update_data = user_update.model_dump(exclude_unset=True)
     if not update_data:
         return current_user
-    if "iin" in update_data or "phone_number" in update_data:
-        check_q = client.query(
-            "SELECT 1 FROM users"
-            "WHERE (iin = %(iin)s OR phone_number = %(phone)s) AND id != %(id)s"
-            "LIMIT 1",
-            parameters={
-                "iin": update_data.get("iin", current_user.iin),
-                "phone": update_data.get("phone_number", current_user.phone_number),
-                "id": user_id,
-            },
+    new_iin = update_data.get("iin")
+    new_phone = update_data.get("phone_number")
+    if new_iin == current_user.iin:
+        new_iin = None
+    if new_phone == current_user.phone_number:
+        new_phone = None
+    if not uniqueness.reserve(
+        user_id, iin=new_iin, phone_number=new_phone, allow_same_owner=True
+    ):
+        raise UserAlreadyExistsError(
+            detail="Пользователь с таким ИИН или телефоном уже существует"
         )
-        if check_q.result_rows:
-            raise UserAlreadyExistsError(
-                detail="Пользователь с таким ИИН или телефоном уже существует"
-            )
 
     set_clauses = [f"{key} = %({key})s" for key in update_data.keys()]
     query = f"""
@@ -162,7 +138,16 @@ def update_user(user_id: str, user_update: UserUpdate) -> User:
         WHERE id  = %(id)s
     """
     update_data["id"] = user_id
-    client.command(query, parameters=update_data)
+    try:
+        client.command(query, parameters=update_data)
+    except Exception:
+        uniqueness.release(user_id, iin=new_iin, phone_number=new_phone)
+        raise
+    uniqueness.release(
+        user_id,
+        iin=current_user.iin if new_iin else None,
+        phone_number=current_user.phone_number if new_phone else None,
+    )
 
     updated_user = current_user.model_copy(update=update_data)
 
@@ -171,9 +156,10 @@ def update_user(user_id: str, user_update: UserUpdate) -> User:
 
 def delete_user(user_id: str):
     client = get_clickhouse_client()
-    get_user_by_id(user_id)
+    user = get_user_by_id(user_id)
     query = "ALTER TABLE users DELETE WHERE id=%(id)s"
     client.command(query, parameters={"id": user_id})
+    uniqueness.release(user_id, iin=user.iin, phone_number=user.phone_number)
 
 
 def log_generation_request(
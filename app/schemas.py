@@ -64,6 +64,7 @@ class User(UserBase):
 
 
 SUPPORTED_DOC_TYPES = Literal["pdf", "docx", "doc"]
+DOCUMENT_PRIORITIES = Literal["high", "normal", "low"]
 
 
 class DocumentRequest(BaseModel):
@@ -75,6 +76,19 @@ class AsyncDocumentRequest(DocumentRequest):
     callback_url: str = Field(
         ..., description="URL для отправки результата обработки документа"
     )
+    priority: DOCUMENT_PRIORITIES = Field(
+        "normal",
+        description="Приоритет: high для интерактивных запросов, low для массовых",
+    )
+    client_id: str | None = Field(
+        None,
+        max_length=64,
+        pattern=r"^[\w.-]+$",
+        description=(
+            "Необязательный идентификатор клиента: делит очередь API-ключа "
+            "на справедливые доли, не более MAX_CLIENTS_PER_KEY активных"
+        ),
+    )
 
 
 class DocumentResponse(BaseModel):
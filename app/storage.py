@@ -0,0 +1,11 @@
+import os
+import re
+
+GENERATED_DOCS_DIR = os.getenv("GENERATED_DOCS_DIR", "generated_docs")
+DOCUMENT_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.(pdf|docx)$")
+
+
+def document_path(name: str) -> str | None:
+    if not DOCUMENT_NAME_PATTERN.match(name):
+        return None
+    return os.path.join(GENERATED_DOCS_DIR, name[:2], name[2:4], name)
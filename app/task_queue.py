@@ -0,0 +1,60 @@
+import os
+import time
+import hashlib
+from .exceptions import TooManyClientsError
+
+# Формат ключей совпадает с generator/scheduler.py: воркер выбирает поток
+# из FLOWS_KEY по справедливой очереди и забирает задачу из его списка.
+FLOWS_KEY = "generator:flows"
+CLIENTS_KEY_PREFIX = "generator:clients:"
+MAX_CLIENTS_PER_KEY = int(os.getenv("MAX_CLIENTS_PER_KEY", "32"))
+CLIENT_IDLE_SECONDS = int(os.getenv("CLIENT_IDLE_SECONDS", "3600"))
+
+# client_id задает вызывающий, поэтому он только делит поток API-ключа на
+# подпотоки. Скрипт помнит client_id, активные за CLIENT_IDLE_SECONDS, и
+# отказывает новому, если их уже MAX_CLIENTS_PER_KEY: смена client_id на
+# каждый запрос не дает ни лишних долей очереди, ни бесконечных потоков.
+_REGISTER_CLIENT_SCRIPT = """
+    local now = tonumber(ARGV[2])
+    local idle = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - idle)
+    if redis.call('ZSCORE', KEYS[1], ARGV[1])
+        or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) then
+        redis.call('ZADD', KEYS[1], now, ARGV[1])
+        redis.call('EXPIRE', KEYS[1], idle)
+        return 1
+    end
+    return 0
+"""
+
+
+def queue_key(doc_type: str, priority: str, tenant: str) -> str:
+    return f"generator:queue:{doc_type}:{priority}:{tenant}"
+
+
+def flow_member(doc_type: str, priority: str, tenant: str) -> str:
+    return f"{doc_type}:{priority}:{tenant}"
+
+
+def tenant_for(redis_conn, api_key: str, client_id: str | None = None) -> str:
+    key_tenant = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    if not client_id:
+        return key_tenant
+    register_client = redis_conn.register_script(_REGISTER_CLIENT_SCRIPT)
+    allowed = register_client(
+        keys=[f"{CLIENTS_KEY_PREFIX}{key_tenant}"],
+        args=[client_id, time.time(), CLIENT_IDLE_SECONDS, MAX_CLIENTS_PER_KEY],
+    )
+    if not allowed:
+        raise TooManyClientsError(MAX_CLIENTS_PER_KEY)
+    return f"{key_tenant}.{client_id}"
+
+
+def enqueue_task(
+    redis_conn, task_key: str, payload: str, doc_type: str, priority: str, tenant: str
+):
+    pipe = redis_conn.pipeline(transaction=True)
+    pipe.set(task_key, payload)
+    pipe.rpush(queue_key(doc_type, priority, tenant), task_key)
+    pipe.sadd(FLOWS_KEY, flow_member(doc_type, priority, tenant))
+    pipe.execute()
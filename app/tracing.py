@@ -0,0 +1,90 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from .repository import get_clickhouse_client
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "api"
+SPANS_TABLE = "generation_spans"
+SPAN_COLUMNS = [
+    "request_id",
+    "stage",
+    "service",
+    "start_time",
+    "duration_us",
+    "status",
+]
+SPAN_BATCH_SIZE = int(os.getenv("SPAN_BATCH_SIZE", "500"))
+SPAN_FLUSH_INTERVAL = float(os.getenv("SPAN_FLUSH_INTERVAL", "5"))
+
+_spans = []
+_lock = threading.Lock()
+_flusher_loop: asyncio.AbstractEventLoop | None = None
+_flush_requested: asyncio.Event | None = None
+
+
+def record_span(
+    request_id: str, stage: str, start: float, duration: float, status: str = "ok"
+):
+    row = [
+        str(request_id),
+        stage,
+        SERVICE_NAME,
+        datetime.fromtimestamp(start),
+        max(int(duration * 1_000_000), 0),
+        status,
+    ]
+    with _lock:
+        _spans.append(row)
+        full = len(_spans) >= SPAN_BATCH_SIZE
+    # Запись в ClickHouse делает фоновый flush_periodically, а не поток
+    # запроса, который случайно набрал полную пачку.
+    if full and _flusher_loop is not None:
+        _flusher_loop.call_soon_threadsafe(_flush_requested.set)
+
+
+@contextmanager
+def span(request_id: str, stage: str):
+    start = time.time()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        record_span(request_id, stage, start, time.time() - start, status)
+
+
+def flush():
+    global _spans
+    with _lock:
+        rows, _spans = _spans, []
+    if not rows:
+        return
+    try:
+        get_clickhouse_client().insert(SPANS_TABLE, rows, column_names=SPAN_COLUMNS)
+    except Exception as e:
+        logger.error(f"Не удалось записать {len(rows)} спанов в ClickHouse: {e}")
+
+
+async def flush_periodically():
+    global _flusher_loop, _flush_requested
+    _flush_requested = asyncio.Event()
+    _flusher_loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_flush_requested.wait(), SPAN_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _flush_requested.clear()
+            await run_in_threadpool(flush)
+    finally:
+        _flusher_loop = None
@@ -0,0 +1,119 @@
+import logging
+import re
+from typing import List
+from clickhouse_connect.driver.client import Client
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+IIN_KEY_PREFIX = "uniq:iin:"
+PHONE_KEY_PREFIX = "uniq:phone:"
+
+# Все ключи проверяются и занимаются одним скриптом, поэтому два
+# параллельных запроса с одинаковым ИИН или телефоном не пройдут оба.
+# Ключ, уже принадлежащий тому же владельцу, допустим только при
+# изменении пользователя (ARGV[2] == '1'): при создании ID вычисляется
+# как max(id)+1 и может совпасть у двух параллельных запросов.
+_RESERVE_SCRIPT = redis_client.register_script(
+    """
+    for _, key in ipairs(KEYS) do
+        local owner = redis.call('GET', key)
+        if owner and (ARGV[2] ~= '1' or owner ~= ARGV[1]) then
+            return 0
+        end
+    end
+    for _, key in ipairs(KEYS) do
+        redis.call('SET', key, ARGV[1])
+    end
+    return 1
+    """
+)
+
+_RELEASE_SCRIPT = redis_client.register_script(
+    """
+    local released = 0
+    for _, key in ipairs(KEYS) do
+        if redis.call('GET', key) == ARGV[1] then
+            redis.call('DEL', key)
+            released = released + 1
+        end
+    end
+    return released
+    """
+)
+
+
+def normalize_iin(iin: str) -> str:
+    return re.sub(r"\D", "", iin)
+
+
+def normalize_phone(phone_number: str) -> str:
+    return re.sub(r"\D", "", phone_number)
+
+
+def _index_keys(iin: str | None = None, phone_number: str | None = None) -> List[str]:
+    keys = []
+    if iin:
+        keys.append(f"{IIN_KEY_PREFIX}{normalize_iin(iin)}")
+    if phone_number:
+        keys.append(f"{PHONE_KEY_PREFIX}{normalize_phone(phone_number)}")
+    return keys
+
+
+def reserve(
+    owner_id: str,
+    iin: str | None = None,
+    phone_number: str | None = None,
+    allow_same_owner: bool = False,
+) -> bool:
+    keys = _index_keys(iin, phone_number)
+    if not keys:
+        return True
+    return bool(
+        _RESERVE_SCRIPT(keys=keys, args=[owner_id, "1" if allow_same_owner else "0"])
+    )
+
+
+def release(owner_id: str, iin: str | None = None, phone_number: str | None = None):
+    keys = _index_keys(iin, phone_number)
+    if keys:
+        _RELEASE_SCRIPT(keys=keys, args=[owner_id])
+
+
+def rebuild_index(client: Client) -> int:
+    stale_keys = set()
+    for prefix in (IIN_KEY_PREFIX, PHONE_KEY_PREFIX):
+        stale_keys.update(redis_client.scan_iter(match=f"{prefix}*", count=1000))
+
+    indexed = {}
+    with client.query_row_block_stream(
+        "SELECT id, iin, phone_number FROM users ORDER BY id"
+    ) as stream:
+        for block in stream:
+            pipe = redis_client.pipeline(transaction=False)
+            for user_id, iin, phone_number in block:
+                for key in _index_keys(iin, phone_number):
+                    if key in indexed:
+                        logger.warning(
+                            f"Дубликат {key}: пользователи {indexed[key]} и {user_id}"
+                        )
+                        continue
+                    indexed[key] = user_id
+                    pipe.set(key, user_id)
+                    stale_keys.discard(key)
+            pipe.execute()
+
+    if stale_keys:
+        redis_client.delete(*stale_keys)
+    logger.info(
+        f"Индекс уникальности перестроен: {len(indexed)} ключей, "
+        f"удалено устаревших: {len(stale_keys)}"
+    )
+    return len(indexed)
+
+
+if __name__ == "__main__":
+    from .repository import get_clickhouse_client
+
+    logging.basicConfig(level=logging.INFO)
+    rebuild_index(get_clickhouse_client())
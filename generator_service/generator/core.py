@@ -1,37 +1,97 @@
+import io
 import time
 import logging
 import aiohttp
 from docx import Document
+from storage import store_document
+from tracing import record_span
 
 logger = logging.getLogger(__name__)
 
 
+def _render_docx(user_data: dict) -> bytes:
+    doc = Document()
+    doc.add_heading(f'Карточка:{user_data.get("last_name")}', 0)
+    doc.add_paragraph(f'ИИН:{user_data.get("iin")}')
+    doc.add_paragraph(f'Номер телефона:{user_data.get("phone_number")}')
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _render_pdf(user_data: dict) -> bytes:
+    # Стандартный шрифт Helvetica не содержит кириллицы, поэтому в PDF
+    # попадают только латинские подписи и цифровые поля.
+    lines = [
+        f'User ID: {user_data.get("id")}',
+        f'IIN: {user_data.get("iin")}',
+        f'Phone: {user_data.get("phone_number")}',
+    ]
+    text = " T* ".join(
+        "({}) Tj".format(
+            line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        )
+        for line in lines
+    )
+    content = f"BT /F1 14 Tf 50 800 Td 20 TL {text} ET".encode("latin-1", "replace")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    return bytes(pdf)
+
+
 def generate_fake_document(user_data: dict, content_type: str) -> str:
     user_name = user_data.get("first_name", "N/A")
-    user_id = user_data.get("id", "N/A")
     logger.info(f"Начал генерацию {content_type} для {user_name}...")
 
+    # Старый бинарный .doc не генерируется: "doc" - псевдоним docx, и файл
+    # сохраняется и отдается как OOXML с расширением .docx.
     if content_type == "docx":
-        doc = Document()
-        doc.add_heading(f'Карточка:{user_data.get("last_name")}', 0)
-        doc.add_paragraph(f'ИИН:{user_data.get("iin")}')
-        doc.add_paragraph(f'Номер телефона:{user_data.get("phone_number")}')
+        data = _render_docx(user_data)
+        extension = "docx"
+    elif content_type == "doc":
+        time.sleep(3)
+        data = _render_docx(user_data)
+        extension = "docx"
     else:
         time.sleep(3)
+        data = _render_pdf(user_data)
+        extension = "pdf"
 
-    fake_filename = f"user_{user_id}_profile.{content_type}"
-    fake_url = f"/generated_docs/{fake_filename}"
+    name = store_document(data, extension)
+    url = f"/generated_docs/{name}"
 
-    logger.info(f"Завершил генерацию для {user_name}. Ссылка: {fake_url}")
-    return fake_url
+    logger.info(f"Завершил генерацию для {user_name}. Ссылка: {url}")
+    return url
 
 
-async def send_callback(callback_url: str, payload: dict):
+async def send_callback(callback_url: str, payload: dict, request_id: str = None):
     logger.info(f"Отправляю POST на {callback_url}...")
+    start_time = time.time()
+    status = "error"
     try:
         async with aiohttp.ClientSession() as session:
             async with session.post(callback_url, json=payload) as response:
                 if response.status == 200:
+                    status = "ok"
                     logger.info(f"Callback на {callback_url} успешно доставлен")
                 else:
                     logger.warning(
@@ -39,3 +99,7 @@ async def send_callback(callback_url: str, payload: dict):
                     )
     except Exception as e:
         logger.error(f"КРИТИЧЕСКАЯ ОШИБКА отправки callback {e}")
+    if request_id:
+        record_span(
+            request_id, "worker.callback", start_time, time.time() - start_time, status
+        )
@@ -1,12 +1,27 @@
 import os
 import logging
 import clickhouse_connect
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Security, status
+from fastapi.responses import FileResponse
+from fastapi.security.api_key import APIKeyHeader
+from . import profiling
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("GeneratorAdmin")
 app = FastAPI()
 
+API_KEY = os.getenv("API_KEY")
+api_key_header_scheme = APIKeyHeader(name="My-API-Key", auto_error=False)
+
+
+def get_api_key(api_key_header: str = Security(api_key_header_scheme)):
+    if not API_KEY or api_key_header != API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Неверный или просроченный API ключ",
+        )
+    return api_key_header
+
 
 def get_clickhouse_client():
     return clickhouse_connect.get_client(
@@ -33,6 +48,106 @@ def get_generation_logs(limit: int = 50):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/admin/traces/stages", dependencies=[Depends(get_api_key)])
+def get_stage_latency(hours: int = 24):
+    try:
+        client = get_clickhouse_client()
+        query = """
+            SELECT
+                stage,
+                count() AS count,
+                round(avg(duration_us) / 1000, 2) AS avg_ms,
+                round(quantile(0.5)(duration_us) / 1000, 2) AS p50_ms,
+                round(quantile(0.95)(duration_us) / 1000, 2) AS p95_ms,
+                round(quantile(0.99)(duration_us) / 1000, 2) AS p99_ms,
+                round(max(duration_us) / 1000, 2) AS max_ms
+            FROM generation_spans
+            WHERE start_time >= now() - toIntervalHour(%(hours)s)
+            GROUP BY stage
+            ORDER BY p99_ms DESC
+        """
+        result = client.query(query, parameters={"hours": hours})
+        column_names = result.column_names
+        return [dict(zip(column_names, row)) for row in result.result_rows]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/admin/traces/slowest", dependencies=[Depends(get_api_key)])
+def get_slowest_requests(hours: int = 24, limit: int = 20):
+    try:
+        client = get_clickhouse_client()
+        query = """
+            SELECT
+                request_id,
+                min(start_time) AS started_at,
+                round(
+                    (
+                        max(toUnixTimestamp64Micro(start_time) + duration_us)
+                        - min(toUnixTimestamp64Micro(start_time))
+                    ) / 1000,
+                    2
+                ) AS total_ms,
+                arrayMap(
+                    s -> (s.2, s.3),
+                    arraySort(
+                        groupArray(
+                            (start_time, stage, round(duration_us / 1000, 2))
+                        )
+                    )
+                ) AS stages
+            FROM generation_spans
+            WHERE start_time >= now() - toIntervalHour(%(hours)s)
+            GROUP BY request_id
+            ORDER BY total_ms DESC
+            LIMIT %(limit)s
+        """
+        result = client.query(query, parameters={"hours": hours, "limit": limit})
+        column_names = result.column_names
+        return [dict(zip(column_names, row)) for row in result.result_rows]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/admin/traces/{request_id}", dependencies=[Depends(get_api_key)])
+def get_request_trace(request_id: str):
+    try:
+        client = get_clickhouse_client()
+        query = """
+            SELECT
+                stage,
+                service,
+                start_time,
+                round(duration_us / 1000, 2) AS duration_ms,
+                status
+            FROM generation_spans
+            WHERE request_id = %(request_id)s
+            ORDER BY start_time
+        """
+        result = client.query(query, parameters={"request_id": request_id})
+        column_names = result.column_names
+        return [dict(zip(column_names, row)) for row in result.result_rows]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/admin/profiles", dependencies=[Depends(get_api_key)])
+def list_task_profiles():
+    return profiling.list_profiles()
+
+
+@app.get(
+    "/admin/profiles/{profile_id}",
+    response_class=FileResponse,
+    dependencies=[Depends(get_api_key)],
+)
+def download_task_profile(profile_id: str):
+    path = profiling.profile_path(profile_id)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+
 @app.get("/admin/ping")
 def ping():
     return {"message": "Ping Pong"}
@@ -0,0 +1,140 @@
+import os
+import re
+import sys
+import uuid
+import random
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+PROFILES_MAX_FILES = int(os.getenv("PROFILES_MAX_FILES", "1000"))
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    # Снимает стеки только потоков, в которых профилируемая задача выполняет
+    # работу через run_profiled. Поток event loop не снимается: его делят
+    # корутины всех полос.
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.thread_ids = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @contextmanager
+    def track_current_thread(self):
+        thread_id = threading.get_ident()
+        self.thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            self.thread_ids.discard(thread_id)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+_active_sampler: ContextVar[StackSampler | None] = ContextVar(
+    "active_sampler", default=None
+)
+
+
+def run_profiled(func, *args):
+    sampler = _active_sampler.get()
+    if sampler is None:
+        return func(*args)
+    with sampler.track_current_thread():
+        return func(*args)
+
+
+def profile_path(profile_id: str) -> str | None:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(PROFILES_DIR, f"{profile_id}.folded")
+
+
+def _profile_mtime(name: str) -> float:
+    try:
+        return os.path.getmtime(os.path.join(PROFILES_DIR, name))
+    except FileNotFoundError:
+        return 0
+
+
+def list_profiles() -> list:
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    names = [n for n in os.listdir(PROFILES_DIR) if n.endswith(".folded")]
+    return sorted(names, key=_profile_mtime, reverse=True)
+
+
+def save_profile(profile_id: str, folded: str):
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    with open(profile_path(profile_id), "w") as f:
+        f.write(folded)
+    for name in list_profiles()[PROFILES_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILES_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def profile_task(task_name: str, profile_id: str | None = None):
+    if profile_id is not None and not PROFILE_ID_PATTERN.match(profile_id):
+        profile_id = None
+    if not PROFILING_ENABLED or not (
+        profile_id or random.random() < PROFILE_SAMPLE_RATE
+    ):
+        yield None
+        return
+
+    profile_id = profile_id or uuid.uuid4().hex
+    sampler = StackSampler()
+    token = _active_sampler.set(sampler)
+    sampler.start()
+    try:
+        yield profile_id
+    finally:
+        sampler.stop()
+        _active_sampler.reset(token)
+        save_profile(profile_id, sampler.folded())
+        logger.info(f"Профиль {profile_id} для задачи {task_name} сохранен")
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Iterable, NamedTuple
+
+PRIORITY_WEIGHTS = {"high": 8, "normal": 4, "low": 1}
+DEFAULT_PRIORITY = "normal"
+
+# API кладет ключ задачи в список своего потока и регистрирует поток в
+# множестве FLOWS_KEY (см. app/task_queue.py).
+FLOWS_KEY = "generator:flows"
+
+
+def queue_key(doc_type: str, priority: str, tenant: str) -> str:
+    return f"generator:queue:{doc_type}:{priority}:{tenant}"
+
+
+def flow_member(doc_type: str, priority: str, tenant: str) -> str:
+    return f"{doc_type}:{priority}:{tenant}"
+
+
+def flow_weight(flow: tuple) -> int:
+    _, priority = flow
+    return PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+
+
+class LaneConfig(NamedTuple):
+    cost: int
+    concurrency: int
+    max_pending: int
+
+
+# Дешевые DOCX не должны ждать в одной очереди с тяжелыми PDF: у каждого
+# типа своя полоса, и чем дороже документ, тем меньше у полосы слотов.
+# Очередь допущенных задач короткая, чтобы каждый освободившийся слот
+# выбирался справедливо из всего бэклога в Redis.
+LANES = {
+    "docx": LaneConfig(cost=1, concurrency=4, max_pending=8),
+    "doc": LaneConfig(cost=10, concurrency=2, max_pending=2),
+    "pdf": LaneConfig(cost=10, concurrency=2, max_pending=2),
+}
+
+
+class FairQueue:
+    # Weighted fair queuing по потокам (клиент, приоритет). Метка головной
+    # задачи потока фиксируется, когда поток появляется в бэклоге, и
+    # сдвигается на cost / weight после каждой обслуженной задачи;
+    # следующим обслуживается поток с наименьшей меткой. Клиент с
+    # тысячами задач не вытесняет остальных, high получает больше слотов,
+    # чем low, но low не голодает.
+    def __init__(self, cost: int):
+        self.cost = cost
+        self._head_tags = {}
+        self._virtual_time = 0.0
+
+    def _step(self, flow: tuple) -> float:
+        return self.cost / flow_weight(flow)
+
+    def next_flow(self, flows: Iterable[tuple]) -> tuple:
+        self._head_tags = {
+            flow: self._head_tags.get(flow, self._virtual_time + self._step(flow))
+            for flow in flows
+        }
+        return min(
+            self._head_tags,
+            key=lambda flow: (self._head_tags[flow], -flow_weight(flow), flow),
+        )
+
+    def charge(self, flow: tuple):
+        tag = self._head_tags.get(flow, self._virtual_time + self._step(flow))
+        self._virtual_time = max(self._virtual_time, tag - self._step(flow))
+        self._head_tags[flow] = tag + self._step(flow)
+
+
+class Scheduler:
+    def __init__(self, lanes: dict = LANES):
+        self.lanes = lanes
+        self.fair_queues = {
+            doc_type: FairQueue(config.cost) for doc_type, config in lanes.items()
+        }
+        self.pending = {
+            doc_type: asyncio.Queue(maxsize=config.max_pending)
+            for doc_type, config in lanes.items()
+        }
+
+    def has_room(self, doc_type: str) -> bool:
+        queue = self.pending.get(doc_type)
+        return queue is not None and not queue.full()
+
+    def next_flow(self, doc_type: str, flows: Iterable[tuple]) -> tuple:
+        return self.fair_queues[doc_type].next_flow(flows)
+
+    def submit(self, doc_type: str, flow: tuple, key: str):
+        self.fair_queues[doc_type].charge(flow)
+        self.pending[doc_type].put_nowait(key)
+
+    async def next_task(self, doc_type: str) -> str:
+        return await self.pending[doc_type].get()
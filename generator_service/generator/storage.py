@@ -0,0 +1,32 @@
+import os
+import hashlib
+import tempfile
+
+GENERATED_DOCS_DIR = os.getenv("GENERATED_DOCS_DIR", "generated_docs")
+
+
+def document_path(name: str) -> str:
+    return os.path.join(GENERATED_DOCS_DIR, name[:2], name[2:4], name)
+
+
+def store_document(data: bytes, content_type: str) -> str:
+    name = f"{hashlib.sha256(data).hexdigest()}.{content_type}"
+    path = document_path(name)
+    if os.path.exists(path):
+        return name
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return name
@@ -0,0 +1,61 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "generator"
+SPANS_TABLE = "generation_spans"
+SPAN_COLUMNS = [
+    "request_id",
+    "stage",
+    "service",
+    "start_time",
+    "duration_us",
+    "status",
+]
+
+_spans = []
+_lock = threading.Lock()
+
+
+def record_span(
+    request_id: str, stage: str, start: float, duration: float, status: str = "ok"
+):
+    row = [
+        str(request_id),
+        stage,
+        SERVICE_NAME,
+        datetime.fromtimestamp(start),
+        max(int(duration * 1_000_000), 0),
+        status,
+    ]
+    with _lock:
+        _spans.append(row)
+
+
+@contextmanager
+def span(request_id: str, stage: str):
+    start = time.time()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        record_span(request_id, stage, start, time.time() - start, status)
+
+
+def flush(client_factory):
+    global _spans
+    with _lock:
+        rows, _spans = _spans, []
+    if not rows:
+        return
+    try:
+        client_factory().insert(SPANS_TABLE, rows, column_names=SPAN_COLUMNS)
+    except Exception as e:
+        logger.error(f"Не удалось записать {len(rows)} спанов в ClickHouse: {e}")
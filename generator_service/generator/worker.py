@@ -1,18 +1,36 @@
 import os
 import time
 import json
+import signal
 import asyncio
 import logging
+import functools
 import redis
 import clickhouse_connect
 from core import generate_fake_document, send_callback
+from profiling import profile_task, run_profiled
+from tracing import flush as flush_spans, record_span, span
+from scheduler import (
+    DEFAULT_PRIORITY,
+    FLOWS_KEY,
+    Scheduler,
+    flow_member,
+    queue_key,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("GeneratorWorker")
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-POLL_INTERVAL = 5
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "1"))
+# Допущенные и выполняющиеся задачи лежат в списке обработки воркера, пока
+# не записан результат. При рестарте воркер возвращает их в очереди потоков,
+# поэтому у каждой реплики должен быть свой постоянный WORKER_ID.
+WORKER_ID = os.getenv("WORKER_ID", "generator")
+PROCESSING_KEY = f"generator:processing:{WORKER_ID}"
+LEGACY_TENANT = "legacy"
+DOC_TYPES = ("pdf", "docx", "doc")
 
 
 def get_clickhouse_client():
@@ -24,6 +42,11 @@ def get_clickhouse_client():
     )
 
 
+# Спаны пишутся из отдельного потока одним клиентом; если ClickHouse
+# недоступен, клиент не кэшируется и создается заново при следующем сбросе.
+get_span_client = functools.cache(get_clickhouse_client)
+
+
 def update_log(request_id: str, status: str, duration_ms: int, result_url: str):
     try:
         client = get_clickhouse_client()
@@ -49,18 +72,27 @@ def update_log(request_id: str, status: str, duration_ms: int, result_url: str):
         logger.error(f"Не удалось обновить лог для {request_id}: {e}")
 
 
+def _finish_task(redis_conn, key: str, result: str | None = None):
+    pipe = redis_conn.pipeline(transaction=True)
+    if result is not None:
+        pipe.set(f"{key}_result", result, ex=3600)
+    pipe.delete(key)
+    pipe.lrem(PROCESSING_KEY, 0, key)
+    pipe.execute()
+
+
 async def process_task(redis_conn, ch_client, key: str):
     logger.info(f"Найдена задача: {key}")
     try:
         request_id, doc_type = key.split("_")
     except ValueError:
         logger.warning(f"Неверный формат ключа: {key}. Удаляю")
-        redis_conn.delete(key)
+        _finish_task(redis_conn, key)
         return
     raw_data = redis_conn.get(key)
     if not raw_data:
         logger.warning(f"Ключ {key} есть, но данных нет. Удаляю")
-        redis_conn.delete(key)
+        _finish_task(redis_conn, key)
         return
     try:
         data = json.loads(raw_data)
@@ -68,54 +100,196 @@ async def process_task(redis_conn, ch_client, key: str):
         callback_url = data["callback_url"]
     except (json.JSONDecodeError, KeyError) as e:
         logger.error(f"Неверный формат json в {key}: {e}. Удаляю")
-        redis_conn.delete(key)
+        _finish_task(redis_conn, key)
         return
     start_time = time.time()
+    enqueued_at = data.get("enqueued_at")
+    if enqueued_at:
+        record_span(request_id, "queue.wait", enqueued_at, start_time - enqueued_at)
+    with profile_task(key, profile_id=data.get("profile_id")):
+        try:
+            with span(request_id, "worker.generate"):
+                doc_url = await asyncio.to_thread(
+                    run_profiled, generate_fake_document, user_data, doc_type
+                )
+            status = "COMPLETED"
+            result_payload = {"url": doc_url, "doc_type": doc_type, "status": "success"}
+        except Exception as e:
+            logger.error(f"Ошибка генерации документа для {key}: {e}")
+            doc_url = None
+            status = "FAILED"
+            result_payload = {"error": str(e), "status": "failed"}
+
+        duration_ms = int((time.time() - start_time) * 1000)
+
+        asyncio.create_task(send_callback(callback_url, result_payload, request_id))
+        with span(request_id, "worker.log_write"):
+            await asyncio.to_thread(
+                run_profiled, update_log, request_id, status, duration_ms, doc_url
+            )
+        with span(request_id, "worker.redis_result"):
+            _finish_task(redis_conn, key, json.dumps(result_payload))
+        logger.info(f"Задача {key} завершена за {duration_ms} мс")
+
+
+async def consume_lane(redis_conn, scheduler: Scheduler, doc_type: str):
+    while True:
+        key = await scheduler.next_task(doc_type)
+        try:
+            await process_task(redis_conn, get_clickhouse_client(), key)
+        except Exception as e:
+            logger.error(f"Необработанная ошибка задачи {key}: {e}")
+
+
+def _retire_flow(redis_conn, doc_type: str, tenant: str, priority: str):
+    member = flow_member(doc_type, priority, tenant)
+    redis_conn.srem(FLOWS_KEY, member)
+    # API мог добавить задачу между пустым LPOP и SREM.
+    if redis_conn.llen(queue_key(doc_type, priority, tenant)):
+        redis_conn.sadd(FLOWS_KEY, member)
+
+
+def _take_task(redis_conn, doc_type: str, tenant: str, priority: str) -> str | None:
+    return redis_conn.lmove(
+        queue_key(doc_type, priority, tenant), PROCESSING_KEY, "LEFT", "RIGHT"
+    )
+
 
+def _drain_flow(redis_conn, doc_type: str, tenant: str, priority: str) -> list:
+    keys = []
+    while key := _take_task(redis_conn, doc_type, tenant, priority):
+        keys.append(key)
+    _retire_flow(redis_conn, doc_type, tenant, priority)
+    return keys
+
+
+def admit_tasks(redis_conn, scheduler: Scheduler) -> list:
+    backlog = {}
+    for member in redis_conn.smembers(FLOWS_KEY):
+        try:
+            doc_type, priority, tenant = member.split(":", 2)
+        except ValueError:
+            logger.warning(f"Неверный формат потока {member}. Удаляю")
+            redis_conn.srem(FLOWS_KEY, member)
+            continue
+        backlog.setdefault(doc_type, []).append((tenant, priority))
+
+    unscheduled = []
+    for doc_type, flows in backlog.items():
+        if doc_type not in scheduler.lanes:
+            for tenant, priority in flows:
+                unscheduled.extend(_drain_flow(redis_conn, doc_type, tenant, priority))
+            continue
+        while flows and scheduler.has_room(doc_type):
+            flow = scheduler.next_flow(doc_type, flows)
+            tenant, priority = flow
+            key = _take_task(redis_conn, doc_type, tenant, priority)
+            if key is None:
+                _retire_flow(redis_conn, doc_type, tenant, priority)
+                flows.remove(flow)
+                continue
+            scheduler.submit(doc_type, flow, key)
+    return unscheduled
+
+
+def _task_flow(key: str, raw_data: str) -> tuple:
+    doc_type = key.rsplit("_", 1)[-1]
     try:
-        doc_url = generate_fake_document(user_data, doc_type)
-        status = "COMPLETED"
-        result_payload = {"url": doc_url, "doc_type": doc_type, "status": "success"}
-    except Exception as e:
-        logger.error(f"Ошибка генерации документа для {key}: {e}")
-        doc_url = None
-        status = "FAILED"
-        result_payload = {"error": str(e), "status": "failed"}
+        data = json.loads(raw_data)
+    except json.JSONDecodeError:
+        data = {}
+    priority = data.get("priority", DEFAULT_PRIORITY)
+    tenant = data.get("tenant", LEGACY_TENANT)
+    return doc_type, priority, tenant
 
-    duration_ms = int((time.time() - start_time) * 1000)
 
-    asyncio.create_task(send_callback(callback_url, result_payload))
-    update_log(request_id, status, duration_ms, doc_url)
-    result_key = f"{key}_result"
-    redis_conn.set(result_key, json.dumps(result_payload), ex=3600)
-    redis_conn.delete(key)
-    logger.info(f"Задача {key} завершена за {duration_ms} мс")
+def recover_processing(redis_conn) -> int:
+    keys = redis_conn.lrange(PROCESSING_KEY, 0, -1)
+    for key in reversed(keys):
+        raw_data = redis_conn.get(key)
+        pipe = redis_conn.pipeline(transaction=True)
+        if raw_data:
+            doc_type, priority, tenant = _task_flow(key, raw_data)
+            pipe.lpush(queue_key(doc_type, priority, tenant), key)
+            pipe.sadd(FLOWS_KEY, flow_member(doc_type, priority, tenant))
+        pipe.lrem(PROCESSING_KEY, 1, key)
+        pipe.execute()
+    if keys:
+        logger.info(f"Возвращено в очереди незавершенных задач: {len(keys)}")
+    return len(keys)
+
+
+def _requeue_legacy_task(redis_conn, key: str) -> bool:
+    def requeue(pipe) -> bool:
+        raw_data = pipe.get(key)
+        if not raw_data or pipe.exists(f"{key}_result"):
+            return False
+        try:
+            data = json.loads(raw_data)
+        except json.JSONDecodeError:
+            return False
+        if "tenant" in data:
+            return False
+        data["priority"] = data.get("priority", DEFAULT_PRIORITY)
+        data["tenant"] = LEGACY_TENANT
+        doc_type = key.rsplit("_", 1)[-1]
+        pipe.multi()
+        pipe.set(key, json.dumps(data))
+        pipe.rpush(queue_key(doc_type, data["priority"], LEGACY_TENANT), key)
+        pipe.sadd(FLOWS_KEY, flow_member(doc_type, data["priority"], LEGACY_TENANT))
+        return True
+
+    return redis_conn.transaction(requeue, key, value_from_callable=True)
+
+
+def requeue_legacy_tasks(redis_conn) -> int:
+    # Задачи, поставленные API до появления очередей потоков, есть только в
+    # виде ключей <request_id>_<тип>. Они переносятся в поток LEGACY_TENANT,
+    # а в данные дописывается tenant, чтобы повторный проход их пропустил.
+    requeued = 0
+    for doc_type in DOC_TYPES:
+        for key in redis_conn.scan_iter(match=f"*_{doc_type}", count=1000):
+            if _requeue_legacy_task(redis_conn, key):
+                requeued += 1
+    if requeued:
+        logger.info(f"Перенесено в очередь задач старого формата: {requeued}")
+    return requeued
 
 
 async def main_loop():
     logger.info("Воркер генератора запускается...")
     redis_conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    scheduler = Scheduler()
+    for doc_type, lane in scheduler.lanes.items():
+        for _ in range(lane.concurrency):
+            asyncio.create_task(consume_lane(redis_conn, scheduler, doc_type))
 
-    while True:
-        try:
-            tasks = redis_conn.keys("*_*")
-            tasks_to_process = []
-            for t in tasks:
-                if t.endswith("_result") or t.endswith("_processing"):
-                    continue
-                if not redis_conn.exists(f"{t}_processing"):
-                    tasks_to_process.append(t)
-            if tasks_to_process:
-                logger.info(f"Найдено {len(tasks_to_process)} задач")
-                for t in tasks_to_process:
-                    redis_conn.set(f"{t}_processing", 1, ex=60)
-                for key in tasks_to_process:
+    # SIGTERM отменяет цикл, чтобы успеть записать накопленные спаны.
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    recovered = False
+    try:
+        while True:
+            try:
+                if not recovered:
+                    recover_processing(redis_conn)
+                    requeue_legacy_tasks(redis_conn)
+                    recovered = True
+                unscheduled = admit_tasks(redis_conn, scheduler)
+                for key in unscheduled:
                     await process_task(redis_conn, get_clickhouse_client(), key)
-        except redis.exceptions.ConnectionError:
-            logger.error("Не удалось подключиться к Redis, повторо через 5 секунд")
-        except Exception as e:
-            logger.error(f"Неизвестная ошибка в цикле:{e}")
-        await asyncio.sleep(POLL_INTERVAL)
+                await asyncio.to_thread(flush_spans, get_span_client)
+            except redis.exceptions.ConnectionError:
+                logger.error(
+                    f"Не удалось подключиться к Redis, повтор через {POLL_INTERVAL} с"
+                )
+            except Exception as e:
+                logger.error(f"Неизвестная ошибка в цикле:{e}")
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        logger.info("Воркер генератора останавливается")
+        await asyncio.to_thread(flush_spans, get_span_client)
 
 
 if __name__ == "__main__":
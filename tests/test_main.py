@@ -1,8 +1,20 @@
 import os
+import time
+import threading
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from app.main import app
-from app import repository
+from app import (
+    repository,
+    migrations,
+    uniqueness,
+    storage,
+    profiling,
+    tracing,
+    task_queue,
+)
+from app.redis_client import redis_client
 
 client = TestClient(app)
 TEST_API_KEY = os.getenv("API_KEY")
@@ -15,13 +27,15 @@ HEADERS = {"MY-API-KEY": TEST_API_KEY}
 def cleanup_db():
     client = None
     try:
-        repository.create_table_if_not_exists()
+        repository.run_migrations()
         client = repository.get_clickhouse_client()
         client.command("TRUNCATE TABLE IF EXISTS users")
+        uniqueness.rebuild_index(client)
         yield
     finally:
         if client:
             client.command("TRUNCATE TABLE IF EXISTS users")
+            uniqueness.rebuild_index(client)
 
 
 def create_test_user(iin: str, phone_number: str):
@@ -65,6 +79,43 @@ def test_create_user_and_duplicate_error():
     assert "уже существует" in response_iin.json()["message"]
 
 
+def test_update_duplicate_phone_and_delete_releases_iin():
+    create_test_user("060101300111", "+7 707 600 00 01")
+    user2 = create_test_user("060101300222", "+7 707 600 00 02")
+
+    response = client.put(
+        f"/users/{user2['id']}",
+        json={"phone_number": "+77076000001"},
+        headers=HEADERS,
+    )
+    assert response.status_code == 400
+    assert "уже существует" in response.json()["message"]
+
+    response = client.put(
+        f"/users/{user2['id']}",
+        json={"phone_number": "+7 707 600 00 02"},
+        headers=HEADERS,
+    )
+    assert response.status_code == 200
+
+    response = client.delete(f"/users/{user2['id']}", headers=HEADERS)
+    assert response.status_code == 204
+    create_test_user("060101300222", "+7 707 600 00 03")
+
+
+def test_create_reservation_rejects_same_owner_twice():
+    assert uniqueness.reserve("42", iin="070101300333", phone_number="+77076000033")
+    try:
+        assert not uniqueness.reserve(
+            "42", iin="070101300333", phone_number="+77076000034"
+        )
+        assert uniqueness.reserve(
+            "42", iin="070101300333", phone_number="+77076000033", allow_same_owner=True
+        )
+    finally:
+        uniqueness.release("42", iin="070101300333", phone_number="+77076000033")
+
+
 def test_user_not_found():
     response_get = client.get("/users/999", headers=HEADERS)
     assert response_get.status_code == 404
@@ -116,3 +167,183 @@ def test_generate_async_doc():
     response = client.post("/documents/generate/async/", json=req_data, headers=HEADERS)
     assert response.status_code == 202
     assert "принята в обработку" in response.json()["message"]
+
+
+def test_generate_async_enqueues_into_client_flow():
+    user = create_test_user("999999999999", "+7 707 999 99 99")
+    req_data = {
+        "user_id": user["id"],
+        "content_type": "pdf",
+        "callback_url": "http://test.com/callback",
+        "priority": "high",
+        "client_id": "test-client",
+    }
+    tenant = task_queue.tenant_for(redis_client, TEST_API_KEY, "test-client")
+    flow_queue = task_queue.queue_key("pdf", "high", tenant)
+    member = task_queue.flow_member("pdf", "high", tenant)
+    try:
+        response = client.post(
+            "/documents/generate/async", json=req_data, headers=HEADERS
+        )
+        assert response.status_code == 202
+        request_id = response.json()["message"].split()[1]
+        assert redis_client.sismember(task_queue.FLOWS_KEY, member)
+        assert f"{request_id}_pdf" in redis_client.lrange(flow_queue, 0, -1)
+    finally:
+        redis_client.delete(flow_queue)
+        redis_client.srem(task_queue.FLOWS_KEY, member)
+
+
+def test_generate_async_records_api_spans():
+    user = create_test_user("888888888888", "+7 707 888 88 88")
+    req_data = {
+        "user_id": user["id"],
+        "content_type": "pdf",
+        "callback_url": "http://test.com/callback",
+    }
+    response = client.post("/documents/generate/async", json=req_data, headers=HEADERS)
+    assert response.status_code == 202
+    request_id = response.json()["message"].split()[1]
+
+    tracing.flush()
+    result = repository.get_clickhouse_client().query(
+        "SELECT stage FROM generation_spans WHERE request_id = %(id)s",
+        parameters={"id": request_id},
+    )
+    stages = {row[0] for row in result.result_rows}
+    assert {
+        "api.user_lookup",
+        "api.redis_enqueue",
+        "api.log_write",
+        "api.accept",
+    } <= stages
+
+
+def test_migrations_are_idempotent_and_logs_partitioned():
+    ch = repository.get_clickhouse_client()
+    assert migrations.apply_migrations(ch) == []
+    applied = migrations.get_applied_versions(ch)
+    assert applied == [m.version for m in migrations.MIGRATIONS]
+
+    result = ch.query(
+        "SELECT partition_key, sorting_key FROM system.tables "
+        "WHERE database = currentDatabase() AND name = 'generation_logs'"
+    )
+    partition_key, sorting_key = result.result_rows[0]
+    assert partition_key == "toYYYYMM(request_time)"
+    assert "request_id" in sorting_key
+
+
+def test_request_id_lookup_skips_granules():
+    ch = repository.get_clickhouse_client()
+    ch.command("TRUNCATE TABLE generation_logs")
+    try:
+        ch.command(
+            """
+            INSERT INTO generation_logs
+            SELECT
+                toString(generateUUIDv4()),
+                toString(number % 1000),
+                'pdf',
+                'COMPLETED',
+                now() - number,
+                toInt32(number % 5000),
+                '{"user_data": {}}',
+                NULL
+            FROM numbers(100000)
+        """
+        )
+        request_id = ch.query(
+            "SELECT request_id FROM generation_logs LIMIT 1 OFFSET 54321"
+        ).result_rows[0][0]
+
+        plan = ch.query(
+            "EXPLAIN indexes = 1 "
+            "SELECT * FROM generation_logs WHERE request_id = %(id)s",
+            parameters={"id": request_id},
+        )
+        lines = [row[0].strip() for row in plan.result_rows]
+        index_pos = lines.index("Name: idx_request_id")
+        granules = next(
+            line for line in lines[index_pos:] if line.startswith("Granules:")
+        )
+        selected, total = map(int, granules.split(":")[1].split("/"))
+        assert total > 1
+        assert selected < total
+    finally:
+        ch.command("TRUNCATE TABLE generation_logs")
+
+
+def test_download_generated_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "GENERATED_DOCS_DIR", str(tmp_path))
+    name = "ab" * 32 + ".pdf"
+    path = storage.document_path(name)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4 test")
+
+    response = client.get(f"/generated_docs/{name}", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.content == b"%PDF-1.4 test"
+    etag = response.headers["etag"]
+
+    response = client.get(
+        f"/generated_docs/{name}", headers={**HEADERS, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    response = client.get(
+        f"/generated_docs/{name}", headers={**HEADERS, "Range": "bytes=0-7"}
+    )
+    assert response.status_code == 206
+    assert response.content == b"%PDF-1.4"
+
+    response = client.get("/generated_docs/missing.pdf", headers=HEADERS)
+    assert response.status_code == 404
+
+
+def test_profiling_middleware_saves_folded_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILES_DIR", str(tmp_path))
+    profiled_app = FastAPI()
+    profiled_app.router.route_class = profiling.ProfiledRoute
+    profiled_app.add_middleware(profiling.ProfilingMiddleware)
+
+    @profiled_app.get("/slow")
+    def slow_endpoint():
+        time.sleep(0.05)
+        return {}
+
+    stop = threading.Event()
+
+    def unrelated_job():
+        stop.wait()
+
+    profiled_client = TestClient(profiled_app)
+    response = profiled_client.get("/slow", headers=HEADERS)
+    assert "x-profile-id" not in response.headers
+
+    unrelated = threading.Thread(target=unrelated_job)
+    unrelated.start()
+    try:
+        response = profiled_client.get("/slow", headers={**HEADERS, "X-Profile": "1"})
+    finally:
+        stop.set()
+        unrelated.join()
+    profile_id = response.headers["x-profile-id"]
+
+    response = client.get(f"/profiles/{profile_id}", headers=HEADERS)
+    assert response.status_code == 200
+    assert "slow_endpoint" in response.text
+    assert "unrelated_job" not in response.text
+
+
+def test_save_profile_keeps_newest_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILES_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILES_MAX_FILES", 2)
+    now = time.time()
+    for age, profile_id in ((20, "a" * 32), (10, "b" * 32)):
+        profiling.save_profile(profile_id, "main 1\n")
+        os.utime(profiling.profile_path(profile_id), (now - age, now - age))
+
+    profiling.save_profile("c" * 32, "main 1\n")
+    assert sorted(os.listdir(tmp_path)) == [f"{c * 32}.folded" for c in "bc"]
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+from collections import Counter
+import pytest
+import redis
+from app import task_queue
+from app.exceptions import TooManyClientsError
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "generator_service", "generator")
+)
+
+from scheduler import FLOWS_KEY, FairQueue, LaneConfig, Scheduler  # noqa: E402
+from worker import (  # noqa: E402
+    PROCESSING_KEY,
+    admit_tasks,
+    recover_processing,
+    requeue_legacy_tasks,
+)
+
+BULK_LOW = ("bulk", "low")
+OTHER_NORMAL = ("other", "normal")
+INTERACTIVE_HIGH = ("interactive", "high")
+
+
+@pytest.fixture
+def redis_conn():
+    conn = redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        db=15,
+        decode_responses=True,
+    )
+    conn.flushdb()
+    yield conn
+    conn.flushdb()
+
+
+def pick(queue: FairQueue, flows: list, times: int) -> list:
+    picked = []
+    for _ in range(times):
+        flow = queue.next_flow(flows)
+        queue.charge(flow)
+        picked.append(flow)
+    return picked
+
+
+def enqueue(conn, key: str, doc_type: str, flow: tuple):
+    tenant, priority = flow
+    task_queue.enqueue_task(conn, key, "{}", doc_type, priority, tenant)
+
+
+def pending_keys(scheduler: Scheduler, doc_type: str) -> list:
+    queue = scheduler.pending[doc_type]
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def test_fair_queue_interleaves_flows_by_weight():
+    picked = pick(FairQueue(cost=10), [OTHER_NORMAL, BULK_LOW], 10)
+    assert Counter(picked) == {OTHER_NORMAL: 8, BULK_LOW: 2}
+
+
+def test_fair_queue_serves_high_before_low():
+    queue = FairQueue(cost=10)
+    assert queue.next_flow([BULK_LOW, INTERACTIVE_HIGH]) == INTERACTIVE_HIGH
+
+
+def test_fair_queue_does_not_starve_low():
+    picked = pick(FairQueue(cost=10), [INTERACTIVE_HIGH, BULK_LOW], 9)
+    assert BULK_LOW in picked
+
+
+def test_fair_queue_new_flow_not_delayed_by_bulk_history():
+    queue = FairQueue(cost=10)
+    pick(queue, [OTHER_NORMAL], 1000)
+    assert queue.next_flow([OTHER_NORMAL, ("late", "normal")]) == ("late", "normal")
+
+
+def test_admit_leaves_task_in_redis_when_lane_full(redis_conn):
+    scheduler = Scheduler({"pdf": LaneConfig(cost=10, concurrency=1, max_pending=1)})
+    enqueue(redis_conn, "t1_pdf", "pdf", BULK_LOW)
+    enqueue(redis_conn, "t2_pdf", "pdf", BULK_LOW)
+
+    assert admit_tasks(redis_conn, scheduler) == []
+    assert pending_keys(scheduler, "pdf") == ["t1_pdf"]
+    assert redis_conn.lrange(task_queue.queue_key("pdf", "low", "bulk"), 0, -1) == [
+        "t2_pdf"
+    ]
+    assert redis_conn.lrange(PROCESSING_KEY, 0, -1) == ["t1_pdf"]
+
+
+def test_admit_returns_unknown_doc_type_as_unscheduled(redis_conn):
+    scheduler = Scheduler({"pdf": LaneConfig(cost=10, concurrency=1, max_pending=1)})
+    enqueue(redis_conn, "t1_xls", "xls", BULK_LOW)
+
+    assert admit_tasks(redis_conn, scheduler) == ["t1_xls"]
+    assert redis_conn.smembers(FLOWS_KEY) == set()
+
+
+def test_admit_picks_high_priority_task_behind_bulk_backlog(redis_conn):
+    scheduler = Scheduler({"pdf": LaneConfig(cost=10, concurrency=2, max_pending=2)})
+    for i in range(500):
+        enqueue(redis_conn, f"bulk{i}_pdf", "pdf", BULK_LOW)
+    enqueue(redis_conn, "interactive_pdf", "pdf", INTERACTIVE_HIGH)
+
+    admit_tasks(redis_conn, scheduler)
+    assert "interactive_pdf" in pending_keys(scheduler, "pdf")
+    assert redis_conn.llen(task_queue.queue_key("pdf", "low", "bulk")) == 499
+
+
+def test_recover_processing_returns_admitted_tasks_to_their_flow(redis_conn):
+    enqueue(redis_conn, "t1_pdf", "pdf", BULK_LOW)
+    enqueue(redis_conn, "t2_pdf", "pdf", BULK_LOW)
+    redis_conn.set("t1_pdf", json.dumps({"priority": "low", "tenant": "bulk"}))
+    redis_conn.set("t2_pdf", json.dumps({"priority": "low", "tenant": "bulk"}))
+    admit_tasks(redis_conn, Scheduler({"pdf": LaneConfig(10, 2, 2)}))
+
+    assert recover_processing(redis_conn) == 2
+    assert redis_conn.llen(PROCESSING_KEY) == 0
+    assert redis_conn.lrange(task_queue.queue_key("pdf", "low", "bulk"), 0, -1) == [
+        "t1_pdf",
+        "t2_pdf",
+    ]
+    scheduler = Scheduler({"pdf": LaneConfig(10, 1, 1)})
+    admit_tasks(redis_conn, scheduler)
+    assert pending_keys(scheduler, "pdf") == ["t1_pdf"]
+
+
+def test_requeue_legacy_tasks_moves_unfinished_keys_once(redis_conn):
+    redis_conn.set("old1_pdf", json.dumps({"user_data": {}, "callback_url": ""}))
+    redis_conn.set("old2_docx", json.dumps({"user_data": {}, "callback_url": ""}))
+    redis_conn.set("old2_docx_result", json.dumps({"status": "success"}))
+
+    assert requeue_legacy_tasks(redis_conn) == 1
+    assert requeue_legacy_tasks(redis_conn) == 0
+    assert redis_conn.lrange(
+        task_queue.queue_key("pdf", "normal", "legacy"), 0, -1
+    ) == ["old1_pdf"]
+    assert json.loads(redis_conn.get("old1_pdf"))["tenant"] == "legacy"
+
+
+def test_tenant_for_caps_client_ids_per_api_key(redis_conn, monkeypatch):
+    monkeypatch.setattr(task_queue, "MAX_CLIENTS_PER_KEY", 2)
+    first = task_queue.tenant_for(redis_conn, "key", "a")
+    task_queue.tenant_for(redis_conn, "key", "b")
+
+    assert task_queue.tenant_for(redis_conn, "key", "a") == first
+    with pytest.raises(TooManyClientsError):
+        task_queue.tenant_for(redis_conn, "key", "c")
+    assert task_queue.tenant_for(redis_conn, "other-key", "c")
+    assert task_queue.tenant_for(redis_conn, "key") not in (first, "key")